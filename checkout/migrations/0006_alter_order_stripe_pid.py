@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-08-30 07:20
+
+from django.db import migrations, models
+
+
+def backfill_blank_stripe_pids(apps, schema_editor):
+    """
+    Give pre-existing orders without a payment intent id a unique
+    placeholder so the unique constraint below can be applied.
+    """
+    Order = apps.get_model('checkout', 'Order')
+    for order in Order.objects.filter(stripe_pid=''):
+        order.stripe_pid = f'legacy-{order.order_number}'
+        order.save(update_fields=['stripe_pid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('checkout', '0005_alter_order_stripe_pid'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_blank_stripe_pids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='stripe_pid',
+            field=models.CharField(default='', max_length=254, unique=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+import smtplib
+
+from celery import shared_task
+
+from django.core.mail import EmailMessage, get_connection
+from django.conf import settings
+
+
+@shared_task(autoretry_for=(smtplib.SMTPException,), retry_backoff=True)
+def send_order_confirmation_email(subject, body, recipients):
+    """
+    Sends an already-rendered confirmation email.
+
+    The webhook handler renders the templates while the order is hot in
+    memory and enqueues plain strings, so this task touches no database
+    rows — it just hands the message to the SMTP backend.
+    """
+    with get_connection() as connection:
+        EmailMessage(
+            subject,
+            body,
+            settings.DEFAULT_FROM_EMAIL,
+            recipients,
+            connection=connection,
+        ).send()
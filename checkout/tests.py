@@ -1,3 +1,19 @@
+import inspect
+
 from django.test import TestCase
 
-# Create your tests here.
+from checkout.webhook_handler import StripeWH_Handler
+
+
+class StripeWHHandlerTests(TestCase):
+
+    def test_single_handler_class_in_expected_module(self):
+        """
+        Guard against duplicate copies of the handler creeping back in:
+        the one canonical class must live in checkout.webhook_handler.
+        """
+        self.assertEqual(StripeWH_Handler.__module__, 'checkout.webhook_handler')
+
+        with open(inspect.getsourcefile(StripeWH_Handler)) as f:
+            source = f.read()
+        self.assertEqual(source.count('class StripeWH_Handler'), 1)
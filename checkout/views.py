@@ -51,37 +51,50 @@ def checkout(request):
         }
         order_form = OrderForm(form_data)
         if order_form.is_valid():
-            order = order_form.save(commit=False)
             pid = request.POST.get('client_secret').split('_secret')[0]
-            order.stripe_pid = pid
-            order.original_bag = json.dumps(bag)
-            order.save()
+            # The webhook no longer waits for this view, so it can win
+            # the race and create the order first. get_or_create on the
+            # unique stripe_pid picks up that row instead of raising an
+            # IntegrityError on save. sort_keys keeps the serialised
+            # bag deterministic so both writers store the same string
+            order, created = Order.objects.get_or_create(
+                stripe_pid=pid,
+                defaults={
+                    **order_form.cleaned_data,
+                    'original_bag': json.dumps(bag, sort_keys=True),
+                },
+            )
+            if not created:
+                # The webhook already created the order and its line
+                # items; nothing left to write here
+                request.session['save_info'] = 'save-info' in request.POST
+                return redirect(reverse(
+                    'checkout_success', args=[order.order_number]))
             for item_id, item_data in bag.items():
-                try:
-                    product = Product.objects.get(id=item_id)
-                    if isinstance(item_data, int):
-                        order_line_item = OrderLineItem(
-                            order=order,
-                            product=product,
-                            quantity=item_data,
-                        )
-                        order_line_item.save()
-                    else:
-                        for size, quantity in item_data['items_by_size'].items():
-                            order_line_item = OrderLineItem(
-                                order=order,
-                                product=product,
-                                quantity=quantity,
-                                product_size=size,
-                            )
-                            order_line_item.save()
-                except Product.DoesNotExist:
+                product = Product.objects.filter(id=item_id).first()
+                if product is None:
                     messages.error(request, (
                         "One of the products in your bag wasn't found in our database. "
                         "Please call us for assistance!")
                     )
                     order.delete()
                     return redirect(reverse('view_bag'))
+                if isinstance(item_data, int):
+                    order_line_item = OrderLineItem(
+                        order=order,
+                        product=product,
+                        quantity=item_data,
+                    )
+                    order_line_item.save()
+                else:
+                    for size, quantity in item_data['items_by_size'].items():
+                        order_line_item = OrderLineItem(
+                            order=order,
+                            product=product,
+                            quantity=quantity,
+                            product_size=size,
+                        )
+                        order_line_item.save()
 
             request.session['save_info'] = 'save-info' in request.POST
             return redirect(reverse('checkout_success', args=[order.order_number]))
@@ -103,22 +116,21 @@ def checkout(request):
             currency=settings.STRIPE_CURRENCY,
         )
 
+        profile = None
         if request.user.is_authenticated:
-            try:
-                profile = UserProfile.objects.get(user=request.user)
-                order_form = OrderForm(initial={
-                    'full_name': profile.user.get_full_name(),
-                    'email': profile.user.email,
-                    'phone_number': profile.default_phone_number,
-                    'country': profile.default_country,
-                    'postcode': profile.default_postcode,
-                    'town_or_city': profile.default_town_or_city,
-                    'street_address1': profile.default_street_address1,
-                    'street_address2': profile.default_street_address2,
-                    'county': profile.default_county,
-                })
-            except UserProfile.DoesNotExist:
-                order_form = OrderForm()
+            profile = UserProfile.objects.filter(user=request.user).first()
+        if profile:
+            order_form = OrderForm(initial={
+                'full_name': profile.user.get_full_name(),
+                'email': profile.user.email,
+                'phone_number': profile.default_phone_number,
+                'country': profile.default_country,
+                'postcode': profile.default_postcode,
+                'town_or_city': profile.default_town_or_city,
+                'street_address1': profile.default_street_address1,
+                'street_address2': profile.default_street_address2,
+                'county': profile.default_county,
+            })
         else:
             order_form = OrderForm()
 
@@ -144,7 +156,12 @@ def checkout_success(request, order_number):
     Handle successful checkouts
     """
     save_info = request.session.get('save_info')
-    order = get_object_or_404(Order, order_number=order_number)
+    # The success template iterates order.lineitems.all and each item's
+    # product, so prefetch both to render in one query instead of 1 + 2L
+    order = get_object_or_404(
+        Order.objects.prefetch_related('lineitems__product'),
+        order_number=order_number,
+    )
 
     if request.user.is_authenticated:
         profile = UserProfile.objects.get(user=request.user)
@@ -1,15 +1,41 @@
-from django.http import HttpResponse
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
 from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.template.loader import get_template
 
 from .models import Order, OrderLineItem
+from .tasks import send_order_confirmation_email
 from products.models import Product
 from profiles.models import UserProfile
 
+import cachetools
 import stripe
 import json
-import time
+
+# In-process L1 in front of the shared cache guard below: during a
+# retry storm duplicate deliveries to the same worker are answered
+# with a plain dict lookup, before any Redis or database round-trip
+_recent_events = cachetools.TTLCache(maxsize=10000, ttl=600)
+
+# Maps Order model fields to the matching keys of a Stripe shipping
+# address; defined once so the profile-defaults update and the order
+# creation below cannot drift apart
+_ADDRESS_FIELD_MAP = (
+    ('country', 'country'),
+    ('postcode', 'postal_code'),
+    ('town_or_city', 'city'),
+    ('street_address1', 'line1'),
+    ('street_address2', 'line2'),
+    ('county', 'state'),
+)
+
+# Load the compiled templates once at import time so each email only
+# pays for rendering, not template loading and compilation
+_SUBJECT_TPL = get_template(
+    'checkout/confirmation_emails/confirmation_email_subject.txt')
+_BODY_TPL = get_template(
+    'checkout/confirmation_emails/confirmation_email_body.txt')
 
 
 class StripeWH_Handler:
@@ -18,25 +44,6 @@ class StripeWH_Handler:
     def __init__(self, request):
         self.request = request
 
-    def _send_confirmation_email(self, order):
-        """Sends a confirmation email to the customer after a successful order."""
-        cust_email = order.email
-        subject = render_to_string(
-            'checkout/confirmation_emails/confirmation_email_subject.txt',
-            {'order': order}
-        )
-        body = render_to_string(
-            'checkout/confirmation_emails/confirmation_email_body.txt',
-            {'order': order, 'contact_email': settings.DEFAULT_FROM_EMAIL}
-        )
-
-        send_mail(
-            subject,
-            body,
-            settings.DEFAULT_FROM_EMAIL,
-            [cust_email]
-        )
-
     def handle_event(self, event):
         """Handles any webhook event that does not have a dedicated method."""
         return HttpResponse(
@@ -58,13 +65,49 @@ class StripeWH_Handler:
         Stripe's 2025 API no longer includes `charges` on the payment intent,
         so we must fetch the charge using latest_charge.
         """
+        # Stripe retries deliveries, so claim the event id first —
+        # locally, then in the shared cache. cache.add is atomic
+        # (SET NX on Redis), meaning only one worker ever processes a
+        # given event; retries get an immediate 200 without touching
+        # the database
+        event_key = (event['id'], event.get('created'))
+        if event_key in _recent_events:
+            return HttpResponse(
+                content=(
+                    f"Webhook received: {event['type']} | "
+                    f"Duplicate event ignored."
+                ),
+                status=200,
+            )
+        _recent_events[event_key] = True
+
+        if not cache.add(f"stripe:evt:{event['id']}", '1', timeout=86400):
+            return HttpResponse(
+                content=(
+                    f"Webhook received: {event['type']} | "
+                    f"Duplicate event ignored."
+                ),
+                status=200,
+            )
+
+        # Any failure from here on must release both claims, otherwise
+        # Stripe's retry of this delivery would be answered as a
+        # duplicate and the order lost for good
+        try:
+            return self._process_payment_intent(event)
+        except Exception as e:
+            _recent_events.pop(event_key, None)
+            cache.delete(f"stripe:evt:{event['id']}")
+            return HttpResponse(
+                content=f"Webhook error: Could not process event — {e}",
+                status=500
+            )
+
+    def _process_payment_intent(self, event):
+        """Creates (or picks up) the order for a claimed payment event."""
         intent = event.data.object
         pid = intent.id
 
-        # Fetch the real charge (required in new API versions)
-        latest_charge_id = intent.latest_charge
-        charge = stripe.Charge.retrieve(latest_charge_id)
-
         # Read bag data (may be a dict or JSON string)
         bag_raw = intent.metadata.get("bag", "{}")
         try:
@@ -72,134 +115,134 @@ class StripeWH_Handler:
         except Exception:
             bag_data = {}
 
+        # Serialise the bag once; sort_keys keeps the output
+        # deterministic so the original_bag lookup below matches
+        # what the checkout view stored
+        original_bag_json = json.dumps(bag_data, sort_keys=True)
+
         save_info = intent.metadata.get("save_info")
         username = intent.metadata.get("username")
 
         # Extract contact information
-        billing_details = charge.billing_details
         shipping_details = intent.shipping
 
-        # Use the first non-empty email we can find
+        # Use the first non-empty email already on the event; only fall
+        # back to fetching the charge (an extra Stripe round-trip) when
+        # the intent carries no email at all
         email = (
-            billing_details.email
+            getattr(intent, "receipt_email", None)
             or getattr(shipping_details, "email", None)
-            or "noemail@example.com"
         )
-
-        grand_total = round(charge.amount / 100, 2)
-
-        # Replace blank address fields with None so Django validation works
-        for field, value in shipping_details.address.items():
-            if value == "":
-                shipping_details.address[field] = None
-
-        # Handle logged-in user profiles
+        if not email:
+            charge = stripe.Charge.retrieve(intent.latest_charge)
+            email = charge.billing_details.email or "noemail@example.com"
+
+        # The intent reports the captured amount, so the charge is not
+        # needed for the total either
+        grand_total = round(intent.amount_received / 100, 2)
+
+        # Copy the address with blank fields replaced by None so Django
+        # validation works, rather than mutating the Stripe object
+        # while iterating it
+        address = {
+            field: (value or None)
+            for field, value in shipping_details.address.items()
+        }
+
+        # Order-model view of the address, built once and shared by the
+        # profile update and the order defaults below
+        address_fields = {
+            field: address[key] for field, key in _ADDRESS_FIELD_MAP
+        }
+
+        # Handle logged-in user profiles. select_related pulls the user
+        # in the same query, and first() avoids exception-driven control
+        # flow when no profile matches
         profile = None
         if username and username != "AnonymousUser":
-            profile = UserProfile.objects.get(user__username=username)
+            profile = UserProfile.objects.select_related('user').filter(
+                user__username=username).first()
 
-            if save_info:
+            if profile and save_info:
                 profile.default_phone_number = shipping_details.phone
-                profile.default_country = shipping_details.address.country
-                profile.default_postcode = shipping_details.address.postal_code
-                profile.default_town_or_city = shipping_details.address.city
-                profile.default_street_address1 = shipping_details.address.line1
-                profile.default_street_address2 = shipping_details.address.line2
-                profile.default_county = shipping_details.address.state
+                for field, value in address_fields.items():
+                    setattr(profile, f'default_{field}', value)
                 profile.save()
 
-        # Try several times to find an order already created during checkout
-        order = None
-        order_exists = False
-        attempt = 1
-
-        while attempt <= 5:
-            try:
-                order = Order.objects.get(
-                    full_name__iexact=shipping_details.name,
-                    email__iexact=email,
-                    phone_number__iexact=shipping_details.phone,
-                    country__iexact=shipping_details.address.country,
-                    postcode__iexact=shipping_details.address.postal_code,
-                    town_or_city__iexact=shipping_details.address.city,
-                    street_address1__iexact=shipping_details.address.line1,
-                    street_address2__iexact=shipping_details.address.line2,
-                    county__iexact=shipping_details.address.state,
-                    grand_total=grand_total,
-                    original_bag=json.dumps(bag_data),
-                    stripe_pid=pid,
-                )
-                order_exists = True
-                break
-            except Order.DoesNotExist:
-                attempt += 1
-                time.sleep(1)
-
-        # If we found an order, email confirmation and finish
-        if order_exists:
-            self._send_confirmation_email(order)
-            return HttpResponse(
-                content=(
-                    f"Webhook received: {event['type']} | "
-                    f"Order already existed — confirmation email sent."
-                ),
-                status=200,
-            )
-
-        # If no order found, create a new one
-        try:
-            order = Order.objects.create(
-                full_name=shipping_details.name,
-                user_profile=profile,
-                email=email,
-                phone_number=shipping_details.phone,
-                country=shipping_details.address.country,
-                postcode=shipping_details.address.postal_code,
-                town_or_city=shipping_details.address.city,
-                street_address1=shipping_details.address.line1,
-                street_address2=shipping_details.address.line2,
-                county=shipping_details.address.state,
-                grand_total=grand_total,
-                original_bag=json.dumps(bag_data),
+        # stripe_pid is unique per payment, so an atomic get_or_create
+        # is idempotent: if the checkout view (or a concurrent webhook
+        # retry) already wrote the order we pick it up, otherwise we
+        # create it — no polling loop and no duplicate orders. The
+        # atomic block rolls back the order and its line items together
+        # on any failure, so no manual cleanup is needed.
+        with transaction.atomic():
+            order, created = Order.objects.get_or_create(
                 stripe_pid=pid,
+                defaults={
+                    'full_name': shipping_details.name,
+                    'user_profile': profile,
+                    'email': email,
+                    'phone_number': shipping_details.phone,
+                    'grand_total': grand_total,
+                    'original_bag': original_bag_json,
+                    **address_fields,
+                },
             )
 
-            # Build the order line items
-            for item_id, item_data in bag_data.items():
-                product = Product.objects.get(id=item_id)
-
-                # Single item (no size variants)
-                if isinstance(item_data, int):
-                    OrderLineItem.objects.create(
-                        order=order,
-                        product=product,
-                        quantity=item_data
-                    )
-                else:
-                    # Multiple sizes (e.g., clothing)
-                    for size, quantity in item_data["items_by_size"].items():
-                        OrderLineItem.objects.create(
+            if created:
+                # Fetch every product in one query, then build all the
+                # line items in memory for a single bulk insert. Only
+                # the pk (FK target) and price (lineitem_total) are
+                # needed, so skip the heavy description/image columns
+                products = Product.objects.only('id', 'price').in_bulk(
+                    [int(i) for i in bag_data])
+
+                line_items = []
+                for item_id, item_data in bag_data.items():
+                    product = products[int(item_id)]
+
+                    # Single item (no size variants)
+                    if isinstance(item_data, int):
+                        line_items.append(OrderLineItem(
                             order=order,
                             product=product,
-                            quantity=quantity,
-                            product_size=size,
+                            quantity=item_data,
+                            lineitem_total=product.price * item_data,
+                        ))
+                    else:
+                        # Multiple sizes (e.g., clothing)
+                        line_items.extend(
+                            OrderLineItem(
+                                order=order,
+                                product=product,
+                                quantity=quantity,
+                                product_size=size,
+                                lineitem_total=product.price * quantity,
+                            )
+                            for size, quantity
+                            in item_data["items_by_size"].items()
                         )
 
-        except Exception as e:
-            if order:
-                order.delete()
-            return HttpResponse(
-                content=f"Webhook error: Could not create order — {e}",
-                status=500
-            )
+                # bulk_create skips OrderLineItem.save() and the
+                # post_save signal, so set lineitem_total above and
+                # update the order totals once here
+                OrderLineItem.objects.bulk_create(
+                    line_items, batch_size=200)
+                order.update_total()
 
-        # Send confirmation email on success
-        self._send_confirmation_email(order)
+        # Render the email here, where the order is already in memory,
+        # and enqueue the finished strings so the task needs no DB read
+        subject = _SUBJECT_TPL.render({'order': order})
+        body = _BODY_TPL.render(
+            {'order': order, 'contact_email': settings.DEFAULT_FROM_EMAIL})
+        send_order_confirmation_email.delay(subject, body, [order.email])
 
         return HttpResponse(
             content=(
                 f"Webhook received: {event['type']} | "
-                f"New order created successfully."
+                + ("New order created successfully."
+                   if created else
+                   "Order already existed — confirmation email queued.")
             ),
             status=200
         )
\ No newline at end of file
@@ -21,7 +21,9 @@ def profile(request):
             messages.error(request, 'Update failed. Please ensure the form is valid.')
     else:
         form = UserProfileForm(instance=profile)
-    orders = profile.orders.all()
+    # The profile template iterates each order's line items and their
+    # products, so prefetch both to avoid an N+1 over the history
+    orders = profile.orders.prefetch_related('lineitems__product')
 
     template = 'profiles/profile.html'
     context = {
@@ -34,7 +36,10 @@ def profile(request):
 
 
 def order_history(request, order_number):
-    order = get_object_or_404(Order, order_number=order_number)
+    order = get_object_or_404(
+        Order.objects.prefetch_related('lineitems__product'),
+        order_number=order_number,
+    )
 
     messages.info(request, (
         f'This is a past confirmation for order number {order_number}. '
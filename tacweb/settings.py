@@ -230,6 +230,29 @@ else:
     EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASS')  # your Gmail App Password
     DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Cache — Redis in production so webhook idempotency keys are shared
+# across workers; the default local-memory cache is used in development
+
+if 'REDIS_URL' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# Celery
+
+CELERY_BROKER_URL = os.environ.get(
+    'CELERY_BROKER_URL',
+    os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+)
+
+# Run tasks synchronously in development and tests, where no worker is running
+if 'DEVELOPMENT' in os.environ:
+    CELERY_TASK_ALWAYS_EAGER = True
+    CELERY_TASK_EAGER_PROPAGATES = True
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -1,13 +1,21 @@
+import copy
+
 from django.shortcuts import render
 from allauth.account.forms import LoginForm, SignupForm
 
+# Build the unbound forms once at import time; allauth form init runs
+# field and widget setup that is identical for every GET request, so
+# each request only pays for a shallow copy
+_LOGIN_FORM_TEMPLATE = LoginForm()
+_SIGNUP_FORM_TEMPLATE = SignupForm()
+
 
 def account_view(request):
     """
     Renders a single page containing both login and register forms
     """
     context = {
-        "login_form": LoginForm(),
-        "signup_form": SignupForm(),
+        "login_form": copy.copy(_LOGIN_FORM_TEMPLATE),
+        "signup_form": copy.copy(_SIGNUP_FORM_TEMPLATE),
     }
-    return render(request, "user_account/account.html", context)
\ No newline at end of file
+    return render(request, "user_account/account.html", context)